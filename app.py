@@ -1,8 +1,11 @@
-from flask import Flask
-from flask_cors import CORS
-from flasgger import Swagger
+from quart import Quart
+from quart_cors import cors
+from quart_schema import QuartSchema
+import logging
+import queue
 import secrets
 import os
+from logging.handlers import QueueHandler, QueueListener
  
 from grafityMain import grafitymain_bp
 from quickStart import quickstart_bp
@@ -14,9 +17,9 @@ from grafityGet import grafity_bp
  
 SECRET_KEY = secrets.token_urlsafe(32)
  
-app = Flask(__name__)
-swagger = Swagger(app)
-CORS(app, origins=["http://localhost:4200"])
+app = Quart(__name__)
+QuartSchema(app)
+app = cors(app, allow_origin=["http://localhost:4200"])
  
 # app.config["SECRET_KEY"] = os.urandom(24)
 # app.config["REFRESH_SECRET_KEY"] = os.urandom(24)
@@ -27,6 +30,33 @@ app.register_blueprint(grafity_bp)
 app.register_blueprint(grafitymain_bp)
 app.register_blueprint(quickstart_bp)
  
+# Hand log records to a queue and let a background listener thread do the actual
+# (blocking) handler I/O, so request handling never waits on stderr/file writes.
+# Started per serving process, not at import: threads don't survive a fork, so a
+# listener started before gunicorn --preload forks would never drain the workers' queues.
+_log_listener = None
+ 
+@app.before_serving
+async def start_queue_logging():
+    global _log_listener
+    root = logging.getLogger()
+    log_queue = queue.SimpleQueue()
+    _log_listener = QueueListener(log_queue, *root.handlers, respect_handler_level=True)
+    root.handlers = [QueueHandler(log_queue)]
+    _log_listener.start()
+ 
+@app.after_serving
+async def stop_queue_logging():
+    global _log_listener
+    # Nothing to undo if startup failed before the listener was created
+    if _log_listener is None:
+        return
+    # Flush what's queued and give the real handlers back to the root logger
+    _log_listener.stop()
+    logging.getLogger().handlers = list(_log_listener.handlers)
+    _log_listener = None
+ 
 if __name__ == "__main__":
-    app.run(debug=True)
+    # Debug mode (and its reloader) only when asked for, e.g. DEBUG=true locally
+    app.run(debug=os.getenv("DEBUG", "false").lower() == "true")
  
\ No newline at end of file
@@ -1,14 +1,13 @@
-from flask import Blueprint,Flask, request, jsonify
+from quart import Blueprint, Response, request, jsonify
 from dataclasses import dataclass
-from neo4j import GraphDatabase
-from pydantic import BaseModel
+from datetime import datetime, timezone
+from pydantic import BaseModel, TypeAdapter
 from typing import List, Optional
+import functools
 import logging
 import os
 import uuid
 import getpass
-import traceback
-import asyncio
  
 from dotenv import load_dotenv
 from pydantic_ai import Agent, RunContext
@@ -18,21 +17,20 @@ from pydantic_ai.providers.openai import OpenAIProvider
 from graphiti_core import Graphiti
 from graphiti_core.nodes import EpisodeType
  
+from graphitiClient import get_graphiti
+ 
 # Load environment variables
 load_dotenv()
  
-# Neo4j + OpenAI credentials
-uri = os.getenv("NEO4J_URI")
-user = os.getenv("NEO4J_USER")
-password = os.getenv("NEO4J_PASSWORD")
+# OpenAI credentials
 api_key = os.getenv('OPENAI_API_KEY')
  
 # Logging setup
-logger = logging.getLogger("flask.app")
+logger = logging.getLogger("quart.app")
 logging.basicConfig(level=logging.DEBUG)
  
-# Flask app
-# app = Flask(__name__)
+# Quart app
+# app = Quart(__name__)
 grafitymain_bp = Blueprint("GrafityMain", __name__, url_prefix="/GrafityMain")
  
 # Dataclass for Graphiti dependencies
@@ -45,13 +43,6 @@ def get_model():
     model_choice = os.getenv('MODEL_CHOICE', 'gpt-4.1-mini')
     return OpenAIModel(model_choice, provider=OpenAIProvider(api_key=api_key))
  
-# Pydantic-AI agent
-graphiti_agent = Agent(
-    get_model(),
-    system_prompt="You are a helpful assistant with access to a knowledge graph filled with temporal data about LLMs.",
-    deps_type=GraphitiDependencies
-)
- 
 # Result model
 class GraphitiSearchResult(BaseModel):
     uuid: str
@@ -60,6 +51,9 @@ class GraphitiSearchResult(BaseModel):
     invalid_at: Optional[str] = None
     source_node_uuid: Optional[str] = None
  
+# Serializes a whole result list straight to JSON bytes in pydantic-core
+search_results_adapter = TypeAdapter(List[GraphitiSearchResult])
+ 
 # Search request schema
 class SearchRequest(BaseModel):
     query: str
@@ -71,48 +65,58 @@ class EpisodeRequest(BaseModel):
     type: str  # "text" or "json"
     description: str
  
-# Hardcoded model & usage for RunContext
-model = "default-model"
-usage = {
-    "user": getpass.getuser(),
-    "request_id": str(uuid.uuid4())
-}
+# OS user reported in RunContext usage; looked up once, it can't change at runtime
+USER = getpass.getuser()
+ 
+# Episode types by lowercase name, for validating EpisodeRequest.type
+EPISODE_TYPES = {e.name.lower(): e for e in EpisodeType}
  
-# Search tool registered with agent
-@graphiti_agent.tool
+# Search tool, registered with the agent in get_agent()
 async def search_graphiti(ctx: RunContext[GraphitiDependencies], query: str) -> List[GraphitiSearchResult]:
     graphiti = ctx.deps.graphiti_client
     try:
-        logger.info(f"Performing search with query: {query}")
+        logger.info("Performing search with query: %s", query)
         results = await graphiti.search(query)
-        logger.info(f"Search returned {len(results)} results")
+        logger.info("Search returned %d results", len(results))
  
+        # Checked once so the per-result repr is skipped unless DEBUG is on
+        debug_enabled = logger.isEnabledFor(logging.DEBUG)
         formatted_results = []
         for result in results:
-            logger.debug(f"Processing result: {result}")
-            formatted_result = GraphitiSearchResult(
+            if debug_enabled:
+                logger.debug("Processing result: %s", result)
+            valid_at = getattr(result, 'valid_at', None)
+            invalid_at = getattr(result, 'invalid_at', None)
+            formatted_results.append(GraphitiSearchResult(
                 uuid=result.uuid,
                 fact=result.fact,
                 source_node_uuid=getattr(result, 'source_node_uuid', None),
-                valid_at=str(getattr(result, 'valid_at', None)) if getattr(result, 'valid_at', None) else None,
-                invalid_at=str(getattr(result, 'invalid_at', None)) if getattr(result, 'invalid_at', None) else None
-            )
-            formatted_results.append(formatted_result)
+                valid_at=str(valid_at) if valid_at else None,
+                invalid_at=str(invalid_at) if invalid_at else None
+            ))
  
         return formatted_results
  
     except Exception as e:
-        logger.error(f"Error searching Graphiti: {str(e)}", exc_info=True)
+        logger.exception("Error searching Graphiti: %s", e)
         raise Exception(f"Graphiti search failed: {e}")
  
+# Pydantic-AI agent, built on first use instead of on every (re)import
+@functools.lru_cache(maxsize=1)
+def get_agent() -> Agent:
+    return Agent(
+        get_model(),
+        system_prompt="You are a helpful assistant with access to a knowledge graph filled with temporal data about LLMs.",
+        deps_type=GraphitiDependencies,
+        tools=[search_graphiti],
+    )
+ 
 # Async function to insert episode
 async def add_episode_to_graphiti(graphiti: Graphiti, episode: EpisodeRequest):
-    try:
-        episode_type = EpisodeType[episode.type.lower()]
-    except KeyError:
-        raise ValueError(f"Invalid episode type: {episode.type}. Must be one of {[e.name for e in EpisodeType]}")
+    episode_type = EPISODE_TYPES.get(episode.type.lower())
+    if episode_type is None:
+        raise ValueError(f"Invalid episode type: {episode.type}. Must be one of {list(EPISODE_TYPES)}")
  
-    from datetime import datetime, timezone
     await graphiti.add_episode(
         name=episode.name,
         episode_body=episode.content,
@@ -123,23 +127,24 @@ async def add_episode_to_graphiti(graphiti: Graphiti, episode: EpisodeRequest):
  
 # API endpoint: Search
 @grafitymain_bp.route("/Search", methods=["POST"])
-def search_graphiti_api():
+async def search_graphiti_api():
     try:
-        request_data = request.get_json()
-        logger.info(f"Search request data: {request_data}")
+        request_data = await request.get_json()
+        logger.info("Search request data: %s", request_data)
 
         search_request = SearchRequest(**request_data)
-        graphiti_client = Graphiti(uri, user, password)
-        deps = GraphitiDependencies(graphiti_client=graphiti_client)
-        ctx = RunContext(deps=deps, model=model, usage=usage)
+        deps = GraphitiDependencies(graphiti_client=await get_graphiti())
+        usage = {
+            "user": USER,
+            "request_id": uuid.uuid4().hex
+        }
+        ctx = RunContext(deps=deps, model=get_agent().model, usage=usage, prompt=search_request.query)
 
-        # Run async search inside sync endpoint
-        search_results = asyncio.run(search_graphiti(ctx, search_request.query))
-        return jsonify([result.dict() for result in search_results])
+        search_results = await search_graphiti(ctx, search_request.query)
+        return Response(search_results_adapter.dump_json(search_results), mimetype="application/json")
 
-    except Exception as e:
-        logger.error(f"Error handling search request: {str(e)}")
-        logger.error(traceback.format_exc())
+    except Exception:
+        logger.exception("Error handling search request")
         return jsonify({"detail": "An error occurred while processing the request"}), 500
 
  
\ No newline at end of file
@@ -0,0 +1,44 @@
+import asyncio
+import os
+ 
+from dotenv import load_dotenv
+from graphiti_core import Graphiti
+from neo4j import AsyncGraphDatabase
+ 
+# Load .env
+load_dotenv()
+neo4j_uri = os.getenv("NEO4J_URI", "bolt://localhost:7687")
+neo4j_user = os.getenv("NEO4J_USER", "neo4j")
+neo4j_password = os.getenv("NEO4J_PASSWORD", "password")
+ 
+# Neo4j connection pool tuning
+pool_size = int(os.getenv("NEO4J_POOL_SIZE", 64))
+acquisition_timeout = float(os.getenv("NEO4J_ACQ_TIMEOUT", 60))
+ 
+# Build one Graphiti client backed by a pooled Neo4j driver
+async def create_graphiti() -> Graphiti:
+    client = Graphiti(neo4j_uri, neo4j_user, neo4j_password)
+    # Graphiti doesn't expose driver options, so close the default driver it built
+    # (it hasn't connected yet) and swap in one with our pool settings
+    await client.driver.close()
+    client.driver = AsyncGraphDatabase.driver(
+        neo4j_uri,
+        auth=(neo4j_user, neo4j_password),
+        max_connection_pool_size=pool_size,
+        connection_acquisition_timeout=acquisition_timeout,
+    )
+    client.clients.driver = client.driver
+    return client
+ 
+# One client per worker process, shared by every blueprint so they use the same
+# Neo4j pool; built on first use rather than at import (or before a fork)
+_graphiti = None
+_graphiti_lock = asyncio.Lock()
+ 
+async def get_graphiti() -> Graphiti:
+    global _graphiti
+    if _graphiti is None:
+        async with _graphiti_lock:
+            if _graphiti is None:
+                _graphiti = await create_graphiti()
+    return _graphiti
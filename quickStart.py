@@ -1,20 +1,29 @@
 import asyncio
+import functools
+import hashlib
 import json
 import logging
 import os
+from collections import OrderedDict
 from datetime import datetime, timezone
 from logging import INFO
+from typing import List, Literal
 from dotenv import load_dotenv
-from flask import Blueprint,Flask, request, jsonify
+from quart import Blueprint, Response, request, jsonify
 from graphiti_core.utils.maintenance.graph_data_operations import clear_data
-from graphiti_core import Graphiti
 from graphiti_core.nodes import EpisodeType
-from openai import OpenAI
+from openai import AsyncOpenAI, LengthFinishReasonError
+from pydantic import BaseModel, ValidationError
+ 
+from graphitiClient import get_graphiti
  
 # Allowed relationship types   
-ALLOWED_RELATION_TYPES = {
+ALLOWED_RELATION_TYPES = frozenset({
     "does", "performs", "includes", "happens_on", "focuses_on", "practices"
-}
+})
+ 
+# Max episodes processed at the same time in /AddEpisodes
+MAX_CONCURRENT_EPISODES = int(os.getenv("EP_CONCURRENCY", 8))
  
 # Logging config
 logging.basicConfig(
@@ -26,22 +35,27 @@ logger = logging.getLogger(__name__)
  
 # Load .env
 load_dotenv()
-neo4j_uri = os.getenv("NEO4J_URI", "bolt://localhost:7687")
-neo4j_user = os.getenv("NEO4J_USER", "neo4j")
-neo4j_password = os.getenv("NEO4J_PASSWORD", "password")
 openai_api_key = os.getenv("OPENAI_API_KEY")
+extract_model = os.getenv("EXTRACT_MODEL", "gpt-4o-mini")
  
-if not all([neo4j_uri, neo4j_user, neo4j_password, openai_api_key]):
+if not openai_api_key:
     raise ValueError("Missing required environment variables.")
  
-client = OpenAI(api_key=openai_api_key)
-graphiti = Graphiti(neo4j_uri, neo4j_user, neo4j_password)
+# AsyncOpenAI client, created on first use so importing the module (and every
+# worker boot or reload) doesn't build a client it may never use
+_openai_client = None
+ 
+def get_openai() -> AsyncOpenAI:
+    global _openai_client
+    if _openai_client is None:
+        _openai_client = AsyncOpenAI(api_key=openai_api_key)
+    return _openai_client
  
 # -------------------------
 # LLM extract function
 # -------------------------
-async def extract_structured_json(text: str) -> dict:
-    prompt = f"""
+# Kept identical across calls and sent first so OpenAI's prompt-prefix caching can hit
+EXTRACT_INSTRUCTIONS = """
 You are an expert at extracting structured data for knowledge graph generation.
  
 Given a short paragraph, extract:
@@ -60,72 +74,153 @@ Given a short paragraph, extract:
 If no valid relationship can be formed, do NOT include that edge.
  
 Output JSON structure:
-{{
-  "nodes": [{{ "name": "<entity>" }}],
-  "edges": [{{ "source": "<entity>", "target": "<entity>", "type": "<relationship>" }}]
-}}
+{
+  "nodes": [{ "name": "<entity>" }],
+  "edges": [{ "source": "<entity>", "target": "<entity>", "type": "<relationship>" }]
+}
+"""
  
-Now extract from the following paragraph:
+# Shape the LLM must return; edge types are limited to ALLOWED_RELATION_TYPES
+class ExtractedNode(BaseModel):
+    name: str
  
-{text}
-"""
-    completion = client.chat.completions.create(
-        model="gpt-4",
-        messages=[{"role": "user", "content": prompt}],
-        temperature=0.3,
-    )
+class ExtractedEdge(BaseModel):
+    source: str
+    target: str
+    type: Literal[tuple(sorted(ALLOWED_RELATION_TYPES))]
  
-    response_text = completion.choices[0].message.content.strip()
-    logger.info("LLM Response:\n%s", response_text)
+class ExtractedGraph(BaseModel):
+    nodes: List[ExtractedNode]
+    edges: List[ExtractedEdge]
  
+# Recent extraction results keyed by sha256 of the paragraph, plus the LLM calls
+# still in flight so concurrent episodes with the same paragraph share one call,
+# and how many callers are waiting on each of those calls
+EXTRACT_CACHE_SIZE = 1024
+_extract_cache = OrderedDict()
+_extract_inflight = {}
+_extract_waiters = {}
+ 
+async def extract_structured_json(text: str) -> dict:
+    key = hashlib.sha256(text.strip().encode("utf-8")).hexdigest()
+    cached = _extract_cache.get(key)
+    if cached is not None:
+        _extract_cache.move_to_end(key)
+        return cached
+ 
+    task = _extract_inflight.get(key)
+    if task is None:
+        task = asyncio.ensure_future(_extract_with_llm(text))
+        _extract_inflight[key] = task
+        task.add_done_callback(functools.partial(_store_extraction, key))
+    # Shielded so one caller being cancelled doesn't cancel the call for the others,
+    # but once the last waiter is gone nobody needs the result, so cancel the call
+    _extract_waiters[task] = _extract_waiters.get(task, 0) + 1
     try:
-        structured_data = json.loads(response_text)
- 
-        # Filter invalid relationships
-        if "edges" in structured_data:
-            structured_data["edges"] = [
-                edge
-                for edge in structured_data["edges"]
-                if edge.get("type") in ALLOWED_RELATION_TYPES
-            ]
-        return structured_data
-    except json.JSONDecodeError as e:
+        return await asyncio.shield(task)
+    finally:
+        _extract_waiters[task] -= 1
+        if not _extract_waiters[task]:
+            del _extract_waiters[task]
+            task.cancel()
+ 
+# Move a finished LLM call from in-flight to the cache; failures and {} aren't cached
+def _store_extraction(key: str, task: asyncio.Task):
+    _extract_inflight.pop(key, None)
+    if task.cancelled() or task.exception() is not None:
+        return
+    structured_data = task.result()
+    if structured_data:
+        _extract_cache[key] = structured_data
+        if len(_extract_cache) > EXTRACT_CACHE_SIZE:
+            _extract_cache.popitem(last=False)
+ 
+async def _extract_with_llm(text: str) -> dict:
+    try:
+        # Structured outputs: the reply is constrained to the ExtractedGraph schema,
+        # so edge types outside ALLOWED_RELATION_TYPES can't be generated at all
+        completion = await get_openai().beta.chat.completions.parse(
+            model=extract_model,
+            messages=[
+                {"role": "system", "content": EXTRACT_INSTRUCTIONS},
+                {"role": "user", "content": f"Now extract from the following paragraph:\n\n{text}"},
+            ],
+            temperature=0.3,
+            response_format=ExtractedGraph,
+        )
+    except (LengthFinishReasonError, ValidationError) as e:
         logger.error("Failed to parse LLM JSON: %s", e)
         return {}
  
+    message = completion.choices[0].message
+    logger.info("LLM Response:\n%s", message.content)
+ 
+    if message.parsed is None:
+        logger.error("LLM returned no structured output: %s", message.refusal)
+        return {}
+    return message.parsed.model_dump()
+ 
 # -------------------------
 # Insert function
 # -------------------------
+# Merge all entities of an episode and link them to it in one round-trip
+NODES_QUERY = """
+UNWIND $nodes AS row
+MERGE (n:Entity {name: row.name})
+WITH row, n
+MATCH (e:Episode {name: $episode_name})
+MERGE (e)-[:MENTIONS]->(n)
+"""
+ 
+# One constant UNWIND query per allowed relationship type, built once so the
+# same query text (and Neo4j's cached plan) is reused. The type can't be a parameter.
+EDGE_QUERIES = {
+    rel_type: f"""
+UNWIND $edges AS r
+MATCH (a:Entity {{name: r.source}})
+MATCH (b:Entity {{name: r.target}})
+MERGE (a)-[x:`{rel_type}`]->(b)
+"""
+    for rel_type in ALLOWED_RELATION_TYPES
+}
+ 
+# Transaction function for insert_structured_graph; MERGE keeps it safe to retry
+async def _write_structured_graph(tx, nodes: list, edges_by_type: dict, episode_name: str):
+    # Nodes
+    if nodes:
+        result = await tx.run(NODES_QUERY, nodes=nodes, episode_name=episode_name)
+        await result.consume()
+ 
+    # Edges, one UNWIND per relationship type
+    for rel_type, edges in edges_by_type.items():
+        result = await tx.run(EDGE_QUERIES[rel_type], edges=edges)
+        await result.consume()
+ 
 async def insert_structured_graph(driver, structured_data: dict, episode_name: str):
+    nodes = [
+        {"name": node["name"]}
+        for node in structured_data.get("nodes", [])
+        if node.get("name")
+    ]
+ 
+    # Group edges by relationship type
+    edges_by_type = {}
+    for edge in structured_data.get("edges", []):
+        rel_type = edge.get("type")
+        if rel_type not in ALLOWED_RELATION_TYPES:
+            continue
+        edges_by_type.setdefault(rel_type, []).append(
+            {"source": edge.get("source"), "target": edge.get("target")}
+        )
+ 
+    # One managed transaction per episode: a single commit, retried on transient errors
     async with driver.session() as session:
-        # Nodes
-        for node in structured_data.get("nodes", []):
-            name = node.get("name")
-            if name:
-                await session.run("MERGE (n:Entity {name: $name})", name=name)
-                await session.run(
-                    """
-                    MATCH (e:Episode {name: $episode_name})
-                    MATCH (n:Entity {name: $entity_name})
-                    MERGE (e)-[:MENTIONS]->(n)
-                    """,
-                    episode_name=episode_name,
-                    entity_name=name,
-                )
- 
-        # Edges
-        for edge in structured_data.get("edges", []):
-            source = edge.get("source")
-            target = edge.get("target")
-            rel_type = edge.get("type")
-            if rel_type not in ALLOWED_RELATION_TYPES:
-                continue
-            query = f"""
-            MATCH (a:Entity {{name: $source}})
-            MATCH (b:Entity {{name: $target}})
-            MERGE (a)-[r:`{rel_type}`]->(b)
-            """
-            await session.run(query, source=source, target=target)
+        await session.execute_write(_write_structured_graph, nodes, edges_by_type, episode_name)
+ 
+# ISO 8601 reference times repeat a lot in bulk loads, so parse each string once
+@functools.lru_cache(maxsize=4096)
+def parse_reference_time(value: str) -> datetime:
+    return datetime.fromisoformat(value)
  
 # -------------------------
 # API setup
@@ -135,9 +230,9 @@ quickstart_bp = Blueprint("QuickStart", __name__, url_prefix="/QuickStart")
 # // -------- Single Pyload --------------- //
  
 # @quickstart_bp.route("/add_episode", methods=["POST"])
-# def add_episode():
+# async def add_episode():
 #     """API to dynamically add episodes"""
-#     data = request.json
+#     data = await request.get_json()
 #     name = data.get("name")
 #     content = data.get("content")
 #     description = data.get("description", "")
@@ -173,8 +268,7 @@ quickstart_bp = Blueprint("QuickStart", __name__, url_prefix="/QuickStart")
 #             logger.error("Error: %s", e)
 #             return {"error": str(e)}
  
-#     # Run async inside sync Flask
-#     result = asyncio.run(process())
+#     result = await process()
 #     return jsonify(result)
  
 # // ----------- * --------------
@@ -182,67 +276,118 @@ quickstart_bp = Blueprint("QuickStart", __name__, url_prefix="/QuickStart")
 # // -------- Multiple Pyload --------------- //
  
 @quickstart_bp.route("/AddEpisodes", methods=["POST"])
-def add_episodes():
-    """API to add multiple episodes"""
-    episodes = request.json
+async def add_episodes():
+    """API to add multiple episodes, streaming one NDJSON result line per episode"""
+    episodes = await request.get_json()
  
     if not isinstance(episodes, list):
         return jsonify({"error": "Expected a list of episodes"}), 400
  
-    async def process_all():
-        results = []
+    graphiti = await get_graphiti()
  
-        for ep in episodes:
-            name = ep.get("name")
-            content = ep.get("content")
-            description = ep.get("description", "")
-            reference_time = ep.get("reference_time")
+    # Validate every episode up front so a bad row never costs LLM/Neo4j calls
+    rejected = []
+    valid_episodes = []
+    for index, ep in enumerate(episodes):
+        if not isinstance(ep, dict):
+            rejected.append((index, {"error": "Each episode must be a JSON object"}))
+            continue
  
-            if not name or not content:
-                results.append({"error": f"Missing name or content for one episode"})
-                continue
+        name = ep.get("name")
+        content = ep.get("content")
+        reference_time = ep.get("reference_time")
  
-            # Parse reference time
-            ref_time = datetime.now(timezone.utc)
-            if reference_time:
-                try:
-                    ref_time = datetime.fromisoformat(reference_time)
-                except Exception:
-                    results.append({"error": f"Invalid reference_time for episode: {name}"})
-                    continue
+        if not name or not content:
+            rejected.append((index, {"error": f"Missing name or content for one episode"}))
+            continue
  
+        # Parse reference time
+        ref_time = datetime.now(timezone.utc)
+        if reference_time:
             try:
-                await graphiti.add_episode(
-                    name=name,
-                    episode_body=content,
-                    source=EpisodeType.text,
-                    source_description=description,
-                    reference_time=ref_time,
-                )
- 
-                structured_json = await extract_structured_json(content)
-                if structured_json:
-                    await insert_structured_graph(graphiti.driver, structured_json, name)
- 
-                results.append({
-                    "name": name,
-                    "message": "Episode added successfully",
-                    "structured": structured_json
-                })
-            except Exception as e:
-                logger.error("Error in episode '%s': %s", name, e)
-                results.append({"name": name, "error": str(e)})
- 
-        return results
+                ref_time = parse_reference_time(reference_time)
+            except Exception:
+                rejected.append((index, {"error": f"Invalid reference_time for episode: {name}"}))
+                continue
  
-    result = asyncio.run(process_all())
-    return jsonify(result)
+        valid_episodes.append((index, {
+            "name": name,
+            "content": content,
+            "description": ep.get("description", ""),
+            "reference_time": ref_time,
+        }))
+ 
+    async def process_episode(ep):
+        name = ep["name"]
+        content = ep["content"]
+ 
+        # add_episode and the LLM extraction don't depend on each other, run them together
+        add_task = asyncio.create_task(graphiti.add_episode(
+            name=name,
+            episode_body=content,
+            source=EpisodeType.text,
+            source_description=ep["description"],
+            reference_time=ep["reference_time"],
+        ))
+        extract_task = asyncio.create_task(extract_structured_json(content))
+ 
+        try:
+            # The episode node must exist before entities are linked to it
+            await add_task
+            structured_json = await extract_task
+            if structured_json:
+                await insert_structured_graph(graphiti.driver, structured_json, name)
+ 
+            return {
+                "name": name,
+                "message": "Episode added successfully",
+                "structured": structured_json
+            }
+        except Exception as e:
+            extract_task.cancel()
+            logger.error("Error in episode '%s': %s", name, e)
+            return {"name": name, "error": str(e)}
+ 
+    async def handle_one(semaphore, index, ep):
+        async with semaphore:
+            try:
+                return index, await process_episode(ep)
+            except Exception as e:
+                return index, {"name": ep["name"], "error": str(e)}
+ 
+    async def stream_results():
+        # Rejected rows are known already, send them straight away
+        for index, result in rejected:
+            yield json.dumps({"index": index, **result}) + "\n"
+ 
+        # Fan episodes out concurrently, bounded so we don't flood OpenAI/Neo4j
+        semaphore = asyncio.Semaphore(MAX_CONCURRENT_EPISODES)
+        tasks = [
+            asyncio.ensure_future(handle_one(semaphore, index, ep))
+            for index, ep in valid_episodes
+        ]
+        try:
+            # One NDJSON line per episode as soon as it finishes
+            for next_done in asyncio.as_completed(tasks):
+                index, result = await next_done
+                yield json.dumps({"index": index, **result}) + "\n"
+        finally:
+            # Client went away mid-stream: don't leave the remaining episodes running
+            for task in tasks:
+                if not task.done():
+                    task.cancel()
+ 
+    response = Response(stream_results(), mimetype="application/x-ndjson")
+    # Large batches can take minutes; don't cut the stream at RESPONSE_TIMEOUT
+    response.timeout = None
+    return response
  
  
  
  
 @quickstart_bp.route("/Clear", methods=["POST"])
-def clear():
+async def clear():
     """Clear all graph data"""
-    asyncio.run(clear_data(graphiti.driver))
+    graphiti = await get_graphiti()
+    await clear_data(graphiti.driver)
     return jsonify({"message": "Graph cleared"})
\ No newline at end of file